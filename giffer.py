@@ -1,9 +1,26 @@
 #! /usr/bin/env python
 
 import click
+import collections
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import cv2
-import imageio
+from multiprocessing import shared_memory
+import numpy as np
+import os
+from PIL import Image
+import queue
 import sys
+import threading
+
+try:
+    import av
+except ImportError:
+    av = None
+
+try:
+    import pyvips
+except ImportError:
+    pyvips = None
 
 
 colors = { "red": (255, 0, 0),
@@ -27,10 +44,21 @@ font_faces = { 'complex': cv2.FONT_HERSHEY_COMPLEX,
                'triplex': cv2.FONT_HERSHEY_TRIPLEX }
 
 # GIFs won't play at 24 fps (or higher). The internet says 12 to 15 fps is what
-# they try to play. This fudge factor is to reduce the number of frames between
-# the start and stop times. For 24 or 30 fps videos, this will reduce it to what
-# GIF players can handle.
-FRAME_STEP_SIZE = 2
+# they try to play. Only every n-th frame between the start and stop times is
+# used, with n picked from the input's frame rate to get close to this.
+TARGET_FPS = 15
+
+# The number of decoded frames the background decoding thread may get ahead of
+# the resizing
+PREFETCH_SIZE = 8
+
+# Frames share a palette until one of them, mapped onto it, is off by more than
+# PALETTE_MAX_EXTRA_ERROR on average per channel beyond what the frame the
+# palette was built from was. That frame gets a new palette which the frames
+# after it then share. The error is measured on every PALETTE_ERROR_STEP-th row
+# and column.
+PALETTE_MAX_EXTRA_ERROR = 1
+PALETTE_ERROR_STEP = 4
 
 class GifferError(Exception):
     def __init__(self, message):
@@ -39,43 +67,105 @@ class GifferError(Exception):
         super().__init__(self.message)
 
 
-def get_start_and_end_frame(video_path, start_time, end_time):
+def get_start_and_end_frame(video, start_time, end_time):
     """
     Takes the cv2 video, gets the frames per second and then calculates the
     start and end frames given the start and end times
 
     Arguments:
 
-        video: the path to the input video 
+        video: the open cv2.VideoCapture of the input video
         start_time: float, the time where our snippet should start
         start_time: float, the time where our snippet should end
     
     Returns: (start_frame, end_frame) both ints
     """
-    video = cv2.VideoCapture(video_path)
     fps = video.get(cv2.CAP_PROP_FPS)
+    if fps <= 0:
+        raise GifferError("Unable to read the frame rate of the input video")
     start_frame = int(fps * start_time)
     end_frame = int(fps * end_time)
     return start_frame, end_frame
 
+
+def get_frame_step(video):
+    """
+    Works out how many input frames to advance for each frame of the gif, so
+    the gif plays at about TARGET_FPS, and how long each gif frame should be
+    shown so the gif plays at the speed of the input
+
+    Arguments:
+        video: the open cv2.VideoCapture of the input video
+
+    Returns: (step, frame_duration) where step is an int and frame_duration is
+    in seconds
+    """
+    fps = video.get(cv2.CAP_PROP_FPS)
+    if fps <= 0:
+        raise GifferError("Unable to read the frame rate of the input video")
+    step = max(1, round(fps / TARGET_FPS))
+    return step, step / fps
+
+
+def get_frame_durations(n_frames, frame_duration):
+    """
+    Works out how long each frame of the gif is shown. GIF delays are whole
+    hundredths of a second, so each frame's delay is rounded in a way that
+    keeps the running total as close as it can be to n_frames * frame_duration
+
+    Arguments:
+        n_frames: int, the number of frames in the gif
+        frame_duration: float, how long each frame should be shown, in seconds
+
+    Returns: a list of n_frames ints, the delays in milliseconds
+    """
+    ends = [round((i + 1) * frame_duration * 100) * 10 for i in range(n_frames)]
+    return [end - start for start, end in zip([0] + ends, ends)]
+
+
+def get_snippet_frames(start_frame, end_frame, step):
+    """
+    Works out which input frames make up the gif. As giffer always has, the
+    snippet begins one frame before start_frame (or at the first frame)
+
+    Arguments:
+        start_frame: int, the frame at in the input at which the gif will start
+        end_frame: int, the frame in the input at which the gif will stop
+        step: int, only every step-th frame is used
+
+    Returns: a range of input frame numbers
+    """
+    first_frame = max(start_frame - 1, 0)
+    n_frames = len(range(start_frame, end_frame + 1, step))
+    return range(first_frame, first_frame + n_frames * step, step)
+
  
-def get_output_dimensions(video_path, max_dimension):
+def get_output_dimensions(video, video_path, max_dimension):
     """
     Takes the video instance, determines the dimensions of the video,
     calculates the scaling factor to make the maximum dimension of output be
-    that which was requested by the User and returns the desired dimensions.
+    that which was requested by the User and returns the desired dimensions
+    along with the scaling factor.
 
     Arguments:
+        video: the open cv2.VideoCapture of the input video
         video_path: the path to the video file
         max_dimension: int, the maximum desired horizontal or vertical dimension
 
-    Returns: the dimension tuple used by cv2.Resize
+    Returns: (dim, scaling_factor) where dim is the dimension tuple used by
+    cv2.Resize and scaling_factor is the ratio of output to input size
     """
-    video = cv2.VideoCapture(video_path)
-    success, frame = video.read()
-    if success:
-        width = int(frame.shape[1])
-        height = int(frame.shape[0])
+    # The container knows the frame size, only decode a frame if it doesn't
+    # say
+    width = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    if width <= 0 or height <= 0:
+        success, frame = video.read()
+        if success:
+            width = int(frame.shape[1])
+            height = int(frame.shape[0])
+
+    if width > 0 and height > 0:
         max_input_dimension = max(width, height)
 
         if max_dimension:
@@ -87,8 +177,9 @@ def get_output_dimensions(video_path, max_dimension):
             output_height = int(height * scaling_factor)
             dim = (output_width, output_height)
         else:
+            scaling_factor = 1.0
             dim = (width, height)
-        return dim
+        return dim, scaling_factor
     else:
         raise GifferError(f"Unable to read the input file {video_path}")
 
@@ -107,11 +198,16 @@ def find_subtitle_info(subtitle, text_size, dimension, line_width=None, desired_
     Returns: scale, textSize where scale is the scaling factor we will use and
     textSize is the size of the bounding box of the subtitle for the given scaling factor
     """
-    scale = 10
     max_width = dimension[0]
+    # Hershey text height is proportional to the scale, so measure it once at a
+    # large scale (to keep rounding small) and solve for the one we want
+    reference_scale = 10
+    text_size, baseline = cv2.getTextSize(subtitle, font_face, reference_scale, line_width)
+    scale = reference_scale * desired_height / text_size[1]
     while 1:
         text_size, baseline = cv2.getTextSize(subtitle, font_face, scale, line_width)
         if text_size[1] > desired_height:
+            # Only happens when the line width adds to the height
             scale -= 0.1
         else:
             if text_size[0] > max_width:
@@ -121,7 +217,339 @@ def find_subtitle_info(subtitle, text_size, dimension, line_width=None, desired_
             raise ValueError(f"Invalid scale: {scale}")
 
 
-def make_gif(video_path, output_file, start_frame, end_frame, dimension, duration, subtitle=None, loops=None, color=None, line_width=None, text_size=None, font_face=None):
+def read_frames(video_path, frame_numbers, video=None):
+    """
+    Generator that decodes the frames of the snippet, one after another
+
+    Arguments:
+        video_path: str, the path the input video file
+        frame_numbers: range, the input frames to decode, from get_snippet_frames
+        video: an already open cv2.VideoCapture of video_path, opened here if not given
+
+    Yields: the BGR frames of the snippet
+    """
+    if not frame_numbers:
+        return
+    if video is None:
+        video = cv2.VideoCapture(video_path)
+
+    # Seek once, OpenCV's FFmpeg backend goes to the keyframe before the frame
+    # and decodes forward to land exactly on it. Decoding is sequential after
+    # that.
+    video.set(cv2.CAP_PROP_POS_FRAMES, frame_numbers[0])
+
+    for i in frame_numbers:
+        success = video.grab()
+        if success:
+            success, frame = video.retrieve()
+        if not success:
+            raise GifferError(f"Unable to read frame {i} from {video_path}")
+
+        yield frame
+
+        # Skip over the frames we're throwing away. grab() only
+        # advances the stream, it doesn't convert the frame to BGR
+        for _ in range(frame_numbers.step - 1):
+            video.grab()
+
+
+def av_decode_range(video_path, frame_numbers):
+    """
+    Generator that decodes the frames of the snippet with PyAV. It seeks once
+    to the keyframe before the first frame and decodes forward from there,
+    libav converts the frames to RGB itself
+
+    Arguments:
+        video_path: str, the path the input video file
+        frame_numbers: range, the input frames to decode, from get_snippet_frames
+
+    Yields: the RGB frames of the snippet
+    """
+    if av is None:
+        raise GifferError("The av decoder needs PyAV, which is not installed")
+    if not frame_numbers:
+        return
+
+    first_frame = frame_numbers[0]
+    frame_numbers = iter(frame_numbers)
+    wanted = next(frame_numbers, None)
+    with av.open(video_path) as container:
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        fps = stream.average_rate or stream.guessed_rate
+        if not fps:
+            raise GifferError(f"Unable to read the frame rate of {video_path}")
+        first_pts = stream.start_time or 0
+        seek_pts = first_pts + int(first_frame / fps / stream.time_base)
+        container.seek(seek_pts, any_frame=False, backward=True, stream=stream)
+
+        for frame in container.decode(stream):
+            if wanted is None:
+                return
+            if frame.pts is None:
+                continue
+            frame_number = round((frame.pts - first_pts) * stream.time_base * fps)
+            if frame_number < wanted:
+                continue
+            yield frame.to_ndarray(format="rgb24")
+            wanted = next(frame_numbers, None)
+
+    if wanted is not None:
+        raise GifferError(f"Unable to read frame {wanted} from {video_path}")
+
+
+def prefetch_frames(frames, maxsize=PREFETCH_SIZE):
+    """
+    Generator that runs the frames generator on a background thread so
+    decoding overlaps with whatever the caller does with each frame
+
+    Arguments:
+        frames: an iterable of frames, typically from read_frames
+        maxsize: int, the number of frames the decoding may get ahead
+
+    Yields: the frames of frames, in order
+    """
+    frame_queue = queue.Queue(maxsize=maxsize)
+    done = object()
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for frame in frames:
+                if stop.is_set():
+                    return
+                frame_queue.put(frame)
+        except Exception as error:
+            frame_queue.put(error)
+        finally:
+            frame_queue.put(done)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while (item := frame_queue.get()) is not done:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # Drain the queue so a blocked producer can finish
+        while producer.is_alive():
+            try:
+                frame_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def map_frames(function, frames, n_threads):
+    """
+    Generator that applies function to each of the frames on a pool of
+    threads. Only a few frames per thread are in flight at once, so the
+    frames are still streamed rather than all held in memory
+
+    Arguments:
+        function: the function to apply to each frame
+        frames: an iterable of frames
+        n_threads: int, the number of threads to use
+
+    Yields: function(frame) for each of the frames, in order
+    """
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        pending = collections.deque()
+        for frame in frames:
+            pending.append(executor.submit(function, frame))
+            if len(pending) >= 2 * n_threads:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _decode_interval(video_path, shm_name, shape, first_index, frame_numbers, dimension, resize, interpolation):
+    """
+    Worker for decode_parallel. Decodes one interval of the snippet, resizes
+    the frames if asked to and writes them into the shared frames array,
+    starting at position first_index
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        frames = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        for i, frame in enumerate(read_frames(video_path, frame_numbers), first_index):
+            if resize:
+                cv2.resize(frame, dimension, dst=frames[i], interpolation=interpolation)
+            else:
+                frames[i] = frame
+        del frames
+    finally:
+        shm.close()
+
+
+def decode_parallel(video_path, frame_numbers, n_workers, dimension, resize=False, interpolation=cv2.INTER_AREA):
+    """
+    Generator that splits the snippet into n_workers intervals and decodes
+    each of them in its own process. Each worker opens its own capture and
+    seeks once to the beginning of its interval. When resizing, the workers
+    resize the frames before collecting them in shared memory, so only the
+    output sized snippet is held there
+
+    Arguments:
+        video_path: str, the path the input video file
+        frame_numbers: range, the input frames to decode, from get_snippet_frames
+        n_workers: int, the number of processes used to decode the snippet
+        dimension: (int, int) the size of the frames in the shared memory,
+            from get_output_dimensions
+        resize: bool, whether the workers resize the frames to dimension, defaults to False
+        interpolation: the cv2 interpolation used when resizing
+
+    Yields: the BGR frames of the snippet, in order
+    """
+    if not frame_numbers:
+        return
+
+    width, height = dimension
+    shape = (len(frame_numbers), height, width, 3)
+
+    n_workers = min(n_workers, len(frame_numbers))
+    interval = -(-len(frame_numbers) // n_workers)
+    shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)))
+    try:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = []
+            for first_index in range(0, len(frame_numbers), interval):
+                futures.append(executor.submit(
+                    _decode_interval,
+                    video_path,
+                    shm.name,
+                    shape,
+                    first_index,
+                    frame_numbers[first_index:first_index + interval],
+                    dimension,
+                    resize,
+                    interpolation))
+            for future in futures:
+                future.result()
+
+        frames = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        for i in range(len(frames)):
+            # Copy so no view of the shared memory outlives it
+            yield frames[i].copy()
+        del frames
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def make_palette(frame, colors=256):
+    """
+    Builds a palette for frame, which the frames after it can share
+
+    Arguments:
+        frame: (H, W, 3) uint8 array, an RGB frame of the gif
+        colors: int, the number of colors in the palette, defaults to 256
+
+    Returns: a palette ("P" mode) PIL image
+    """
+    return Image.fromarray(frame).quantize(colors=colors, method=Image.Quantize.FASTOCTREE)
+
+
+def palette_error(frame, image):
+    """
+    Measures how far the palette image is from the RGB frame it was made from
+
+    Arguments:
+        frame: (H, W, 3) uint8 array, the RGB frame
+        image: the palette ("P" mode) PIL image of frame
+
+    Returns: float, the mean per channel difference, on a subsample of the pixels
+    """
+    sample = np.s_[::PALETTE_ERROR_STEP, ::PALETTE_ERROR_STEP]
+    quantized = np.asarray(image.convert("RGB"))[sample]
+    return np.abs(frame[sample].astype(np.int16) - quantized).mean()
+
+
+def write_gif(frames, output_file, loops, durations, bitdepth=7, dither=False):
+    """
+    Writes the frames to output_file as a gif. Rather than each frame getting
+    its own palette, frames share one for as long as it fits them. When a
+    frame is too far from the current palette (the scene changed, say), a new
+    one is built from that frame. The RGB frames are quantized one at a time,
+    but Pillow keeps every quantized frame until the gif is saved, so the
+    whole snippet is held in memory once as 8-bit palette images
+
+    Arguments:
+        frames: an iterable of (H, W, 3) uint8 arrays, the RGB frames of the gif
+        output_file: str, the name of the output gif file
+        loops: int, the number of loops after the first playing of the gif
+        durations: list of int, how long each frame is shown, in milliseconds
+        bitdepth: int, the gif has at most 2**bitdepth colors, defaults to 7
+        dither: bool, whether to dither the frames, defaults to False
+    """
+    dither_method = Image.Dither.FLOYDSTEINBERG if dither else Image.Dither.NONE
+    palette = None
+    max_error = 0
+
+    def quantize(frame):
+        nonlocal palette, max_error
+        image = Image.fromarray(frame)
+        if palette is not None:
+            quantized = image.quantize(palette=palette, dither=dither_method)
+            if palette_error(frame, quantized) <= max_error:
+                return quantized
+        palette = make_palette(frame, colors=2 ** bitdepth)
+        quantized = image.quantize(palette=palette, dither=dither_method)
+        max_error = palette_error(frame, quantized) + PALETTE_MAX_EXTRA_ERROR
+        return quantized
+
+    images = map(quantize, frames)
+    first_image = next(images, None)
+    if first_image is None:
+        raise GifferError(f"No frames to write to {output_file}")
+    first_image.save(
+        output_file,
+        save_all=True,
+        append_images=images,
+        loop=loops,
+        duration=durations)
+
+
+def write_gif_vips(frames, output_file, loops, durations, bitdepth=7, dither=False):
+    """
+    Writes the frames to output_file as a gif with libvips. libvips needs the
+    whole animation as one tall image, so all the frames are held in memory
+    in RGB, along with the joined copy, but its encoder is multithreaded and leaves out pixels that barely change
+    from one frame to the next. It is run at the lowest effort, higher
+    efforts take several times longer for about the same size
+
+    Arguments:
+        frames: an iterable of (H, W, 3) uint8 arrays, the RGB frames of the gif
+        output_file: str, the name of the output gif file
+        loops: int, the number of loops after the first playing of the gif
+        durations: list of int, how long each frame is shown, in milliseconds
+        bitdepth: int, the gif has at most 2**bitdepth colors, defaults to 7
+        dither: bool, whether to dither the frames, defaults to False
+    """
+    if pyvips is None:
+        raise GifferError("The vips backend needs pyvips, which is not installed")
+
+    pages = []
+    for frame in frames:
+        height, width, bands = frame.shape
+        pages.append(pyvips.Image.new_from_memory(frame.tobytes(), width, height, bands, "uchar"))
+    if not pages:
+        raise GifferError(f"No frames to write to {output_file}")
+
+    image = pyvips.Image.arrayjoin(pages, across=1).copy()
+    image.set_type(pyvips.GValue.gint_type, "page-height", pages[0].height)
+    image.set_type(pyvips.GValue.gint_type, "loop", loops)
+    image.set_type(pyvips.GValue.array_int_type, "delay", list(durations))
+    image.gifsave(
+        output_file,
+        interframe_maxerror=2.0,
+        effort=1,
+        bitdepth=bitdepth,
+        dither=0.5 if dither else 0.0)
+
+
+def make_gif(video_path, output_file, start_frame, end_frame, dimension, duration, subtitle=None, loops=None, color=None, line_width=None, text_size=None, font_face=None, workers=1, video=None, decoder="opencv", backend="pillow", bitdepth=7, dither=False, step=1, scaling_factor=1.0):
     """
     Takes all the information collected from the command line and generates the
     gif. If a subtitle is to be genrated, it is scaled appropriately and added
@@ -133,47 +561,93 @@ def make_gif(video_path, output_file, start_frame, end_frame, dimension, duratio
         start_frame: int, the frame at in the input at which the gif will start
         end_fram: int, the frame in the input at which the gif will stop
         dimension: (int, int) the dimensions of the output gif
-        duration: float, the length of time from the start frame to the end frame
+        duration: float, how long each frame of the gif is shown, in seconds
         subtitle: str, If added by the user, the subtitle that will be added to each frame
         loops: int, the number of loops after the first playing of the gif
         color: (int, int, int), the rgb color in which to render the subtitle
         line_width: int, the pixel width of the lines used to draw the subtitle letters
         text_size:, int, the size (in pixels) of the subtitle 
         font_face: str, the cv2 font to use when rendereing the subtitle
+        workers: int, the number of processes used to decode the snippet, defaults to 1
+        video: an already open cv2.VideoCapture of video_path, opened if not given
+        decoder: str, "opencv" or "av" (PyAV, which ignores workers), defaults to opencv
+        backend: str, the gif encoder, "pillow" or "vips" (libvips), defaults to pillow
+        bitdepth: int, the gif has at most 2**bitdepth colors, defaults to 7
+        dither: bool, whether to dither the frames, defaults to False
+        step: int, only every step-th frame of the input is used, defaults to 1
+        scaling_factor: float, the ratio of the output to the input size, defaults to 1.0
     """
     if subtitle:
         width, height = dimension
         bounding_box, baseline, scale = find_subtitle_info(subtitle, text_size, dimension, desired_height=text_size, line_width=line_width, font_face=font_face)
+        text_origin = (int(width/2 - bounding_box[0]/2), height - baseline - 4)
+
+    # INTER_AREA is the one to use for shrinking, for anything else
+    # INTER_LINEAR looks as good and is faster
+    resize = bool(dimension) and scaling_factor != 1.0
+    interpolation = cv2.INTER_AREA if scaling_factor < 1.0 else cv2.INTER_LINEAR
+
+    frame_numbers = get_snippet_frames(start_frame, end_frame, step)
+    if decoder == "av":
+        frames = prefetch_frames(av_decode_range(video_path, frame_numbers))
+    elif workers > 1:
+        frames = decode_parallel(video_path, frame_numbers, workers, dimension, resize=resize, interpolation=interpolation)
+        # The workers have already resized the frames
+        resize = False
+    else:
+        frames = prefetch_frames(read_frames(video_path, frame_numbers, video=video))
+
+    # With OpenCL the resize and conversion run on the device, the frame is
+    # uploaded once and only the small RGB result comes back. useOpenCL() is
+    # false when OpenCL isn't available or has been turned off with
+    # cv2.ocl.setUseOpenCL(False) or OPENCV_OPENCL_DEVICE=disabled
+    use_opencl = cv2.ocl.useOpenCL()
+
+    # Otherwise the frames are spread over a pool of threads, OpenCV releases
+    # the GIL while it works
+    n_threads = 1 if use_opencl else os.cpu_count() or 1
+
+    # Work out once which steps each frame goes through, so the options
+    # aren't re-checked for every frame
+    frame_steps = []
+    if use_opencl:
+        frame_steps.append(cv2.UMat)
+    if resize:
+        frame_steps.append(lambda frame: cv2.resize(frame, dimension, interpolation=interpolation))
+    if decoder != "av":
+        # PyAV already hands us RGB frames
+        frame_steps.append(lambda frame: cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    if use_opencl:
+        frame_steps.append(cv2.UMat.get)
+    if subtitle:
+        # putText always draws on the host, so do it after the download
+        frame_steps.append(lambda frame: cv2.putText(frame, subtitle, text_origin, font_face, scale, color, line_width))
+
+    def process_frame(frame):
+        for frame_step in frame_steps:
+            frame = frame_step(frame)
+        return frame
+
+    # The RGB frames are streamed from the decoder to the writer, only the
+    # quantized palette frames of the whole snippet are kept until it is saved
+    if n_threads > 1:
+        rgb_frames = map_frames(process_frame, frames, n_threads)
+    else:
+        rgb_frames = map(process_frame, frames)
+
+    durations = get_frame_durations(len(frame_numbers), duration)
 
-    video = cv2.VideoCapture(video_path)
-    video.set(cv2.CAP_PROP_POS_FRAMES, start_frame - 1)
-    with imageio.get_writer(output_file, mode="I", loop=loops, duration=duration) as writer:
-        for i in range(start_frame, end_frame + 1, FRAME_STEP_SIZE):
-            success, frame = video.read()
-            if not success:
-                raise GifferError(f"Unable to read frame {i} from {video_path}")
-
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            if dimension:
-                rgb_frame = cv2.resize(rgb_frame, dimension, interpolation=cv2.INTER_AREA)
-
-            if subtitle:
-                cv2.putText(
-                    rgb_frame,
-                    subtitle,
-                    (int(width/2 - bounding_box[0]/2), height - baseline - 4),
-                    font_face,
-                    scale,
-                    color, 
-                    line_width)
-            
-            writer.append_data(rgb_frame)
-
-            if FRAME_STEP_SIZE > 1:
-                # Skip over the frames we're throwing away.
-                for j in range(FRAME_STEP_SIZE - 1):
-                    _, _ = video.read()
-            
+    # The cores are used either by the pool, one frame per thread, or by
+    # OpenCV's own threads within each call, not both
+    cv2_threads = cv2.getNumThreads()
+    cv2.setNumThreads(1 if n_threads > 1 else os.cpu_count() or 1)
+    try:
+        if backend == "vips":
+            write_gif_vips(rgb_frames, output_file, loops, durations, bitdepth=bitdepth, dither=dither)
+        else:
+            write_gif(rgb_frames, output_file, loops, durations, bitdepth=bitdepth, dither=dither)
+    finally:
+        cv2.setNumThreads(cv2_threads)
 
 
 @click.command()
@@ -184,43 +658,54 @@ def make_gif(video_path, output_file, start_frame, end_frame, dimension, duratio
 @click.option('--max-dimension', '-m', type=int, help="The maximum dimension of the output file")
 @click.option('--loops', '-l', type=int, help="The number of loops the gif should play defaults to infinite", default=0)
 @click.option('--subtitle', '-st', type=str, help="A string to add to each frame of the gif")
-@click.option('--color', '-c', type=str, help="Text color (red, orange, yellow, green, blue, purple, white, black, gray). Defaults to white", default="white")
+@click.option('--color', '-c', type=click.Choice(list(colors), case_sensitive=False), help="Text color (red, orange, yellow, green, blue, purple, white, black, gray). Defaults to white", default="white")
 @click.option('--line-width', '-lw', type=int, help="The line width used to draw subtitle letters. Defaults to 2", default=2)
 @click.option('--text-size', '-t', type=int, help="The text size in which to write the subtitle. Defaults to 15", default=15)
-@click.option('--font-face', '-f', type=str, help="The cv2 hershey font face in which to write the text (complex, complex_small, duplex, plain, script_complex, script_simplex, simplex, triplex).  Defaults to simplex", default="simplex")
-def giffer(input, start, end, output, max_dimension, loops, subtitle, color, line_width, text_size, font_face):
+@click.option('--font-face', '-f', type=click.Choice(list(font_faces), case_sensitive=False), help="The cv2 hershey font face in which to write the text (complex, complex_small, duplex, plain, script_complex, script_simplex, simplex, triplex).  Defaults to simplex", default="simplex")
+@click.option('--workers', '-w', type=int, help="The number of processes used to decode the snippet. Defaults to 1", default=1)
+@click.option('--decoder', '-d', type=click.Choice(["opencv", "av"]), help="The library used to decode the snippet (opencv, av). Defaults to opencv", default="opencv")
+@click.option('--backend', '-b', type=click.Choice(["pillow", "vips"]), help="The library used to encode the gif (pillow, vips). Defaults to pillow", default="pillow")
+@click.option('--bitdepth', '-bd', type=click.IntRange(1, 8), help="The gif has at most 2**bitdepth colors. Defaults to 7", default=7)
+@click.option('--dither/--no-dither', help="Dither the frames to hide the reduced number of colors. Defaults to no dithering", default=False)
+def giffer(input, start, end, output, max_dimension, loops, subtitle, color, line_width, text_size, font_face, workers, decoder, backend, bitdepth, dither):
     """
     Takes a video file, extracts the frames from start to end and saves them as
     a gif. It reads the fps from the input file and uses that to determine
     where to extract the frames
     """
-    start_frame, end_frame = get_start_and_end_frame(input, start, end)
-    duration = end - start 
-    output_dim = get_output_dimensions(input, max_dimension)
-
-    try:
-        rgb_color = colors[color.lower()]
-    except KeyError:
-        raise GifferError(f"Color {color} is not a supported color name")
+    # Open the input once, everything below reads from this capture
+    video = cv2.VideoCapture(input)
+    if not video.isOpened():
+        raise GifferError(f"Unable to read the input file {input}")
+    start_frame, end_frame = get_start_and_end_frame(video, start, end)
+    step, frame_duration = get_frame_step(video)
+    output_dim, scaling_factor = get_output_dimensions(video, input, max_dimension)
+
+    # click has already checked color and font_face against these names
+    rgb_color = colors[color]
+    cv2_font_face = font_faces[font_face]
 
-    try:
-        cv2_font_face = font_faces[font_face.lower()]
-    except KeyError:
-        raise GifferError(f"Font face {font_face} is not a supported font face name")
-    
     make_gif(
         input,
         output,
         start_frame,
         end_frame,
         output_dim,
-        duration,
+        frame_duration,
         subtitle=subtitle,
         loops=loops,
         color=rgb_color,
         line_width=line_width,
         text_size=text_size,
-        font_face=cv2_font_face)
+        font_face=cv2_font_face,
+        workers=workers,
+        video=video,
+        decoder=decoder,
+        backend=backend,
+        bitdepth=bitdepth,
+        dither=dither,
+        step=step,
+        scaling_factor=scaling_factor)
 
 
 if __name__ == '__main__':